@@ -1,13 +1,104 @@
 """Main bot implementation for the translation bot.
 """
 import argparse
+import json
+import os
+import re
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import argostranslate.package
-import argostranslate.translate
+import argostranslate.settings
+import ctranslate2
 from lxmfy import LXMFBot
 from lxmfy.attachments import IconAppearance, pack_icon_appearance_field
 
+STORAGE_PATH = "translate_data"
+INSTALLED_PAIRS_FILE = os.path.join(STORAGE_PATH, "installed_pairs.json")
+
+# Latin punctuation needs trailing whitespace; CJK and Devanagari marks do not.
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|(?<=[。！？।॥])\s*")
+# Longer sentences are cut into chunks so translations stay within MAX_DECODING_LENGTH.
+MAX_SENTENCE_LENGTH = 250
+
+# Quantize weights to INT8 as models are loaded, when the CPU supports it.
+COMPUTE_TYPE = "int8" if "int8" in ctranslate2.get_supported_compute_types("cpu") else "default"
+
+
+def _usable_cpu_count():
+    """Return the number of CPUs this process is allowed to run on."""
+    if hasattr(os, "process_cpu_count"):
+        return os.process_cpu_count() or 1
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# One translation at a time, spread over roughly the physical cores. Halving the
+# usable CPUs is a guess that assumes two hyper-threads per core.
+INTRA_THREADS = max(1, _usable_cpu_count() // 2)
+
+MAX_CACHED_TRANSLATORS = 16
+DOWNLOAD_WORKERS = 8
+
+# Greedy search keeps chat replies fast; longer outputs are cut off.
+BEAM_SIZE = 1
+MAX_DECODING_LENGTH = 256
+
+HELP_TEXT = """LXMFy Translate Bot Help
+
+Available Commands:
+
+translate <source_lang> <target_lang> <text>
+   Translate text between languages
+   - Example: translate en es Hello world
+   - Example: translate fr en Bonjour le monde
+   - Note: Language codes are 2-letter (en, es, fr, de, it, pt, etc.)
+
+languages
+   Show all available language codes for translation
+   - Example: languages
+   - Returns a list of supported language codes
+
+stats
+   Show bot statistics and performance metrics
+   - Example: stats
+   - Shows uptime, translations completed, average response time, and model status
+
+help
+   Show this help message
+   - Example: help
+
+Language Code Examples:
+- en = English    es = Spanish    fr = French
+- de = German     it = Italian    pt = Portuguese
+- ru = Russian    zh = Chinese    ja = Japanese
+- ar = Arabic     hi = Hindi      ko = Korean
+
+Tips:
+- All commands work offline once models are downloaded
+- First translation of a language pair downloads the model automatically
+- Invalid language pairs will show an error message
+
+Need more languages? Use languages to see what's available!"""
+
+
+def split_sentences(paragraph):
+    """Split a paragraph into sentences of at most MAX_SENTENCE_LENGTH characters."""
+    sentences = []
+    for sentence in SENTENCE_BOUNDARY.split(paragraph.strip()):
+        while len(sentence) > MAX_SENTENCE_LENGTH:
+            cut = sentence.rfind(" ", 0, MAX_SENTENCE_LENGTH)
+            if cut <= 0:
+                cut = MAX_SENTENCE_LENGTH
+            sentences.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
 
 class TranslateBot:
     """A translation bot that uses Argos Translate for offline translations.
@@ -15,17 +106,25 @@ class TranslateBot:
 
     def __init__(self):
         """Initialize the translation bot."""
-        argostranslate.package.update_package_index()
-        self.available_packages = argostranslate.package.get_available_packages()
+        # Without a local index, get_available_packages() fetches it synchronously.
+        has_local_index = argostranslate.settings.local_package_index.exists()
+        self._index_packages(argostranslate.package.get_available_packages())
+        self._installed_packages = None
+        self._installed_generation = 0
+        self._installed_lock = threading.Lock()
+        self._install_lock = threading.Lock()
+        self._pairs_lock = threading.Lock()
+        self._translators = OrderedDict()
+        self._translators_lock = threading.Lock()
+        self._translator_load_locks = {}
 
         self.start_time = time.time()
         self.translations_completed = 0
         self.total_translation_time = 0.0
-        self.translation_times = []
         self.bot = LXMFBot(
             name="LXMFy Translate Bot",
             command_prefix="",
-            storage_path="translate_data",
+            storage_path=STORAGE_PATH,
             permissions_enabled=True,
             signature_verification_enabled=False,
             require_message_signatures=False,
@@ -42,6 +141,13 @@ class TranslateBot:
         # Register commands
         self.register_commands()
 
+        self.installed_pairs = self._load_installed_pairs()
+
+        self._index_thread = None
+        if has_local_index:
+            self._index_thread = threading.Thread(target=self._refresh_index, daemon=True)
+            self._index_thread.start()
+
     def register_commands(self):
         """Register all bot commands."""
         @self.bot.command(name="translate", description="Translate text between languages")
@@ -60,99 +166,45 @@ class TranslateBot:
 
             source_lang = ctx.args[0].lower()
             target_lang = ctx.args[1].lower()
-            text = " ".join(ctx.args[2:])
+            text = self._message_text(ctx)
 
-            try:
-                package = next(
-                    (p for p in self.available_packages
-                     if p.from_code == source_lang and p.to_code == target_lang),
-                    None,
+            package = self.package_index.get((source_lang, target_lang))
+            if not package:
+                ctx.reply(
+                    f"Sorry, translation from {source_lang} to {target_lang} is not available.",
+                    lxmf_fields=self.bot_icon_field,
                 )
+                return
 
-                if package:
-                    translation_start = time.time()
-
-                    argostranslate.package.install_from_path(package.download())
-                    translated = argostranslate.translate.translate(text, source_lang, target_lang)
-
-                    translation_time = time.time() - translation_start
-                    self.translations_completed += 1
-                    self.total_translation_time += translation_time
-                    self.translation_times.append(translation_time)
-
-                    if len(self.translation_times) > 100:
-                        self.translation_times.pop(0)
-
-                    ctx.reply(
-                        f"Translation ({source_lang} → {target_lang}):\n{translated}",
-                        lxmf_fields=self.bot_icon_field,
-                    )
-                else:
-                    ctx.reply(
-                        f"Sorry, translation from {source_lang} to {target_lang} is not available.",
-                        lxmf_fields=self.bot_icon_field,
-                    )
+            translation_start = time.time()
+            try:
+                self._ensure_installed(package)
+                translated = self.translate_text(text, source_lang, target_lang)
             except Exception as e:
                 ctx.reply(
                     f"Error during translation: {e!s}",
                     lxmf_fields=self.bot_icon_field,
                 )
+                return
 
-        @self.bot.command(name="languages", description="List available languages")
-        def languages_command(ctx):
-            """List all available languages for translation."""
-            languages = set()
-            for package in self.available_packages:
-                languages.add(package.from_code)
-                languages.add(package.to_code)
+            translation_time = time.time() - translation_start
+            self.translations_completed += 1
+            self.total_translation_time += translation_time
 
-            lang_list = "\n".join(sorted(languages))
             ctx.reply(
-                f"Available languages:\n{lang_list}",
+                f"Translation ({source_lang} → {target_lang}):\n{translated}",
                 lxmf_fields=self.bot_icon_field,
             )
 
+        @self.bot.command(name="languages", description="List available languages")
+        def languages_command(ctx):
+            """List all available languages for translation."""
+            ctx.reply(self._languages_reply, lxmf_fields=self.bot_icon_field)
+
         @self.bot.command(name="help", description="Show detailed help and usage information")
         def help_command(ctx):
             """Show comprehensive help for all bot commands."""
-            help_text = """LXMFy Translate Bot Help
-
-Available Commands:
-
-translate <source_lang> <target_lang> <text>
-   Translate text between languages
-   - Example: translate en es Hello world
-   - Example: translate fr en Bonjour le monde
-   - Note: Language codes are 2-letter (en, es, fr, de, it, pt, etc.)
-
-languages
-   Show all available language codes for translation
-   - Example: languages
-   - Returns a list of supported language codes
-
-stats
-   Show bot statistics and performance metrics
-   - Example: stats
-   - Shows uptime, translations completed, average response time, and model status
-
-help
-   Show this help message
-   - Example: help
-
-Language Code Examples:
-- en = English    es = Spanish    fr = French
-- de = German     it = Italian    pt = Portuguese
-- ru = Russian    zh = Chinese    ja = Japanese
-- ar = Arabic     hi = Hindi      ko = Korean
-
-Tips:
-- All commands work offline once models are downloaded
-- First translation of a language pair downloads the model automatically
-- Invalid language pairs will show an error message
-
-Need more languages? Use languages to see what's available!"""
-
-            ctx.reply(help_text, lxmf_fields=self.bot_icon_field)
+            ctx.reply(HELP_TEXT, lxmf_fields=self.bot_icon_field)
 
         @self.bot.command(name="stats", description="Show bot statistics and performance metrics")
         def stats_command(ctx):
@@ -160,13 +212,13 @@ Need more languages? Use languages to see what's available!"""
             uptime_seconds = time.time() - self.start_time
             uptime_str = self.format_uptime(uptime_seconds)
 
-            installed_packages = argostranslate.package.get_installed_packages()
+            installed_packages = self.get_installed_packages()
             installed_count = len(installed_packages)
             total_available = len(self.available_packages)
 
             avg_translation_time = 0.0
-            if self.translation_times:
-                avg_translation_time = sum(self.translation_times) / len(self.translation_times)
+            if self.translations_completed:
+                avg_translation_time = self.total_translation_time / self.translations_completed
 
             stats_text = f"""Bot Statistics
 
@@ -192,30 +244,252 @@ Translation Models:
 
             ctx.reply(stats_text, lxmf_fields=self.bot_icon_field)
 
+    @staticmethod
+    def _message_text(ctx):
+        """Return the text to translate, keeping the message's original whitespace."""
+        parts = (getattr(ctx, "content", None) or "").split(None, 3)
+        if len(parts) == 4 and parts[1:3] == ctx.args[:2]:
+            return parts[3]
+        return " ".join(ctx.args[2:])
+
+    def _index_packages(self, packages):
+        """Store available packages along with the lookups derived from them."""
+        package_index = {(p.from_code, p.to_code): p for p in packages}
+        languages = sorted({code for p in packages for code in (p.from_code, p.to_code)})
+        languages_reply = "Available languages:\n" + "\n".join(languages)
+
+        self.available_packages = packages
+        self.package_index = package_index
+        self._languages_reply = languages_reply
+
+    def _refresh_index(self):
+        """Update the remote package index in the background."""
+        try:
+            argostranslate.package.update_package_index()
+            self._index_packages(argostranslate.package.get_available_packages())
+        except Exception as e:
+            print(f"Failed to update package index: {e}")
+
+    def _get_translator(self, source_lang, target_lang):
+        """Load the CTranslate2 model for an installed language pair.
+
+        Returns a ``(translator, package)`` tuple. The most recently used
+        models are kept in memory so each is only loaded from disk once.
+        """
+        key = (source_lang, target_lang)
+        with self._translators_lock:
+            if key in self._translators:
+                self._translators.move_to_end(key)
+                return self._translators[key]
+            pair_lock = self._translator_load_locks.setdefault(key, threading.Lock())
+
+        # Scanning, reinstalling and loading happen under a per-pair lock so
+        # cache hits for other pairs are never blocked behind them.
+        with pair_lock:
+            with self._translators_lock:
+                if key in self._translators:
+                    self._translators.move_to_end(key)
+                    return self._translators[key]
+
+            package = self._find_installed_package(source_lang, target_lang)
+            if package is None:
+                self._invalidate_installed_packages()
+                package = self._find_installed_package(source_lang, target_lang)
+            if package is None and key in self.package_index:
+                # The saved pairs are out of date, e.g. the model was removed from disk.
+                self._forget_installed_pair(key)
+                self._ensure_installed(self.package_index[key])
+                package = self._find_installed_package(source_lang, target_lang)
+            if package is None:
+                raise LookupError(f"No installed model for {source_lang} → {target_lang}")
+
+            translator = ctranslate2.Translator(
+                str(package.package_path / "model"),
+                device="cpu",
+                compute_type=COMPUTE_TYPE,
+                inter_threads=1,
+                intra_threads=INTRA_THREADS,
+            )
+            with self._translators_lock:
+                self._translators[key] = (translator, package)
+                if len(self._translators) > MAX_CACHED_TRANSLATORS:
+                    self._translators.popitem(last=False)
+        return translator, package
+
+    def _find_installed_package(self, source_lang, target_lang):
+        """Return the installed package for a language pair, or None."""
+        return next(
+            (p for p in self.get_installed_packages()
+             if p.from_code == source_lang and p.to_code == target_lang),
+            None,
+        )
+
+    def translate_text(self, text, source_lang, target_lang):
+        """Translate text using the cached model for a language pair.
+
+        Lines are kept as separate paragraphs, and every sentence of every
+        paragraph is translated together in a single batch.
+        """
+        paragraphs = [split_sentences(line) for line in text.split("\n")]
+        sentences = [sentence for paragraph in paragraphs for sentence in paragraph]
+        if not sentences:
+            return ""
+
+        translator, package = self._get_translator(source_lang, target_lang)
+        batch = [package.tokenizer.encode(sentence) for sentence in sentences]
+        target_prefix = [[package.target_prefix]] * len(batch) if package.target_prefix else None
+
+        results = translator.translate_batch(
+            batch,
+            target_prefix=target_prefix,
+            replace_unknowns=True,
+            max_batch_size=len(batch),
+            beam_size=BEAM_SIZE,
+            max_decoding_length=MAX_DECODING_LENGTH,
+        )
+
+        translated_sentences = []
+        for result in results:
+            translated = package.tokenizer.decode(result.hypotheses[0])
+            if package.target_prefix and translated.startswith(package.target_prefix):
+                translated = translated[len(package.target_prefix):]
+            translated_sentences.append(translated.strip())
+
+        translated_paragraphs = []
+        position = 0
+        for paragraph in paragraphs:
+            translated_paragraphs.append(
+                " ".join(translated_sentences[position:position + len(paragraph)]),
+            )
+            position += len(paragraph)
+        return "\n".join(translated_paragraphs).strip("\n")
+
+    def _install_package(self, package):
+        """Download and install a single translation package."""
+        print(f"Downloading {package.from_code} → {package.to_code}...")
+        argostranslate.package.install_from_path(package.download())
+        # Drop the cached package list before the pair becomes visible to readers.
+        self._invalidate_installed_packages()
+        with self._pairs_lock:
+            self.installed_pairs.add((package.from_code, package.to_code))
+            self._save_installed_pairs(self.installed_pairs)
+
+    def _load_installed_pairs(self):
+        """Load installed language pairs saved by a previous run.
+
+        Installed packages are only scanned when no saved pairs exist.
+        """
+        try:
+            with open(INSTALLED_PAIRS_FILE, encoding="utf-8") as f:
+                saved = json.load(f)
+            if not isinstance(saved, list) or not all(
+                isinstance(pair, list) and len(pair) == 2
+                and all(isinstance(code, str) for code in pair)
+                for pair in saved
+            ):
+                raise ValueError("Unexpected installed pairs format")
+            return {tuple(pair) for pair in saved}
+        except (OSError, TypeError, ValueError):
+            return self._scan_installed_pairs()
+
+    def _scan_installed_pairs(self):
+        """Rebuild and save installed language pairs from the packages on disk."""
+        self._invalidate_installed_packages()
+        pairs = {(p.from_code, p.to_code) for p in self.get_installed_packages()}
+        self._save_installed_pairs(pairs)
+        return pairs
+
+    def _forget_installed_pair(self, package_key):
+        """Remove a language pair whose package is no longer installed."""
+        with self._pairs_lock:
+            self.installed_pairs.discard(package_key)
+            self._save_installed_pairs(self.installed_pairs)
+
+    def _save_installed_pairs(self, pairs):
+        """Atomically write installed language pairs to disk.
+
+        Saving is best-effort; the pairs are rebuilt from a package scan when
+        the file is missing.
+        """
+        tmp_path = f"{INSTALLED_PAIRS_FILE}.tmp"
+        try:
+            os.makedirs(STORAGE_PATH, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(sorted(pairs), f)
+            os.replace(tmp_path, INSTALLED_PAIRS_FILE)
+        except OSError as e:
+            print(f"Failed to save installed language pairs: {e}")
+
+    def _ensure_installed(self, package):
+        """Install a package on first use, once even under concurrent requests."""
+        package_key = (package.from_code, package.to_code)
+        if package_key in self.installed_pairs:
+            return
+
+        with self._install_lock:
+            if package_key not in self.installed_pairs:
+                self._install_package(package)
+
+    def _invalidate_installed_packages(self):
+        """Drop the cached package list so the next read rescans."""
+        with self._installed_lock:
+            self._installed_packages = None
+            self._installed_generation += 1
+
+    def get_installed_packages(self):
+        """Return installed packages, rescanning only after a new install."""
+        with self._installed_lock:
+            packages = self._installed_packages
+            generation = self._installed_generation
+        if packages is not None:
+            return packages
+
+        packages = argostranslate.package.get_installed_packages()
+        with self._installed_lock:
+            # A scan that overlapped an install may be stale, so don't cache it.
+            if generation == self._installed_generation:
+                self._installed_packages = packages
+        return packages
+
     def download_all_packages(self):
         """Download all available translation packages."""
         print("Downloading all available translation packages...")
+        if self._index_thread:
+            self._index_thread.join()
+        with self._pairs_lock:
+            self.installed_pairs = self._scan_installed_pairs()
         success_count = 0
         fail_count = 0
         skipped_count = 0
 
-        installed_packages = argostranslate.package.get_installed_packages()
-        installed_keys = {(pkg.from_code, pkg.to_code) for pkg in installed_packages}
-
+        pending = []
         for package in self.available_packages:
             package_key = (package.from_code, package.to_code)
-            if package_key in installed_keys:
+            if package_key in self.installed_pairs:
                 print(f"Skipping {package.from_code} → {package.to_code} (already installed)")
                 skipped_count += 1
-                continue
-
-            try:
-                print(f"Downloading {package.from_code} → {package.to_code}...")
-                argostranslate.package.install_from_path(package.download())
-                success_count += 1
-            except Exception as e:
-                print(f"Failed to download {package.from_code} → {package.to_code}: {e}")
-                fail_count += 1
+            elif package.type == "sbd":
+                # Argos installs sentence boundary detection packages from inside
+                # download() without locking, so these must not run in parallel.
+                try:
+                    self._install_package(package)
+                    success_count += 1
+                except Exception as e:
+                    print(f"Failed to download {package.from_code} → {package.to_code}: {e}")
+                    fail_count += 1
+            else:
+                pending.append(package)
+
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            futures = {executor.submit(self._install_package, p): p for p in pending}
+            for future in as_completed(futures):
+                package = futures[future]
+                try:
+                    future.result()
+                    success_count += 1
+                except Exception as e:
+                    print(f"Failed to download {package.from_code} → {package.to_code}: {e}")
+                    fail_count += 1
 
         print(f"Download complete! {success_count} successful, {fail_count} failed, {skipped_count} skipped (already installed).")
         return success_count, fail_count
@@ -223,30 +497,26 @@ Translation Models:
     def download_specific_packages(self, language_pairs):
         """Download specific language pair packages."""
         print(f"Downloading {len(language_pairs)} specific language pairs...")
+        if self._index_thread:
+            self._index_thread.join()
+        with self._pairs_lock:
+            self.installed_pairs = self._scan_installed_pairs()
         success_count = 0
         fail_count = 0
         skipped_count = 0
 
-        installed_packages = argostranslate.package.get_installed_packages()
-        installed_keys = {(pkg.from_code, pkg.to_code) for pkg in installed_packages}
-
         for from_lang, to_lang in language_pairs:
             package_key = (from_lang, to_lang)
-            if package_key in installed_keys:
+            if package_key in self.installed_pairs:
                 print(f"Skipping {from_lang} → {to_lang} (already installed)")
                 skipped_count += 1
                 continue
 
             try:
-                package = next(
-                    (p for p in self.available_packages
-                     if p.from_code == from_lang and p.to_code == to_lang),
-                    None,
-                )
+                package = self.package_index.get(package_key)
 
                 if package:
-                    print(f"Downloading {from_lang} → {to_lang}...")
-                    argostranslate.package.install_from_path(package.download())
+                    self._install_package(package)
                     success_count += 1
                 else:
                     print(f"Package {from_lang} → {to_lang} not found in available packages")
@@ -264,17 +534,15 @@ Translation Models:
         hours, remainder = divmod(remainder, 3600)
         minutes, seconds = divmod(remainder, 60)
 
-        parts = []
-        if days > 0:
-            parts.append(f"{days}d")
-        if hours > 0:
-            parts.append(f"{hours}h")
-        if minutes > 0:
-            parts.append(f"{minutes}m")
-        if seconds > 0 or not parts:  # Always show seconds if no other parts
-            parts.append(f"{seconds}s")
+        uptime = (
+            (f"{days}d " if days else "")
+            + (f"{hours}h " if hours else "")
+            + (f"{minutes}m " if minutes else "")
+        )
+        if seconds or not uptime:  # Always show seconds if no other parts
+            uptime += f"{seconds}s"
 
-        return " ".join(parts)
+        return uptime.rstrip()
 
     def run(self):
         """Run the translation bot."""
@@ -308,6 +576,15 @@ def main():
 
     args = parser.parse_args()
 
+    pairs = []
+    for arg in args.download or []:
+        if "-" in arg and len(arg.split("-")) == 2:
+            from_lang, to_lang = arg.split("-")
+            pairs.append((from_lang.lower(), to_lang.lower()))
+        else:
+            print(f"Invalid language pair format: {arg}. Use format like 'en-es'")
+            return
+
     bot = TranslateBot()
 
     if args.download_all:
@@ -317,20 +594,10 @@ def main():
         if fail_count > 0:
             print("Some downloads failed. The bot will still work but may download missing models on-demand.")
 
-    elif args.download:
-        pairs = []
-        for arg in args.download:
-            if "-" in arg and len(arg.split("-")) == 2:
-                from_lang, to_lang = arg.split("-")
-                pairs.append((from_lang.lower(), to_lang.lower()))
-            else:
-                print(f"Invalid language pair format: {arg}. Use format like 'en-es'")
-                return
-
-        if pairs:
-            print(f"Downloading {len(pairs)} specific language pair(s)...")
-            success_count, fail_count = bot.download_specific_packages(pairs)
-            print(f"Pre-download complete: {success_count} successful, {fail_count} failed.")
+    elif pairs:
+        print(f"Downloading {len(pairs)} specific language pair(s)...")
+        success_count, fail_count = bot.download_specific_packages(pairs)
+        print(f"Pre-download complete: {success_count} successful, {fail_count} failed.")
 
     if args.require_signatures:
         print("Enabling strict signature verification (required for all messages)")
@@ -6,7 +6,8 @@ setup(
     packages=find_packages(),
     install_requires=[
         "lxmfy>=1.0.1,<2.0.0",
-        "argostranslate>=1.9.6,<2.0.0",
+        "argostranslate>=1.9.6,<1.12.0",
+        "ctranslate2>=4.0.0,<5.0.0",
     ],
     setup_requires=[
         "setuptools>=42",